@@ -10,19 +10,29 @@ Daily Jamf roles sync for roleAutomatorRoles repo.
   - roles/classic-api-roles.json
   - roles/jamf-pro-api-roles.json
   - roles/privilege-categories.json
+- Caches:
+  - docs/.http-cache/ (per-page ETag / Last-Modified, for conditional GETs)
 """
 
 from __future__ import annotations
 
+import hashlib
 import json
-import re
-from dataclasses import dataclass
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Iterator, NamedTuple, Sequence, Set, Tuple, Optional, Union
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from lxml import etree
+from lxml import html as lxml_html
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json writes identical output
+    orjson = None  # type: ignore[assignment]
 
 CLASSIC_URL = "https://developer.jamf.com/jamf-pro/docs/classic-api-minimum-required-privileges-and-endpoint-mapping"
 PROD_URL = "https://developer.jamf.com/jamf-pro/docs/privileges-and-deprecations"
@@ -30,70 +40,133 @@ PROD_URL = "https://developer.jamf.com/jamf-pro/docs/privileges-and-deprecations
 ROOT = Path(__file__).resolve().parent
 ROLES_DIR = ROOT / "roles"
 DOCS_DIR = ROOT / "docs"
+HTTP_CACHE_DIR = DOCS_DIR / ".http-cache"
+
+# Cached validators only vouch for roles/ as written by this exact script.
+SCRIPT_SHA1 = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()
+
+OUTPUT_FILES = [
+    "jamf-roles.json",
+    "classic-api-roles.json",
+    "jamf-pro-api-roles.json",
+    "privilege-categories.json",
+]
+
+# Jamf docs are served as UTF-8; say so rather than trusting <meta> sniffing.
+HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+
+# Data rows only: tr[td] drops header-only rows inside libxml2.
+_XP_ROWS_WITH_TD = etree.XPath(".//tr[td]")
+
+# Both pages live on developer.jamf.com; one pooled session keeps the TLS connection alive.
+SESSION = requests.Session()
+SESSION.headers.update(
+    {
+        "User-Agent": "roleAutomatorRoles-sync/1.0",
+        "Accept": "text/html,application/xhtml+xml",
+    }
+)
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
 
 
 def clean(s: str) -> str:
-    s = s.replace("\u00a0", " ")
-    s = re.sub(r"\s+", " ", s)
-    return s.strip()
-
-
-def fetch_html(url: str, timeout: int = 30) -> str:
-    r = requests.get(
-        url,
-        timeout=timeout,
-        headers={
-            "User-Agent": "roleAutomatorRoles-sync/1.0",
-            "Accept": "text/html,application/xhtml+xml",
-        },
-    )
+    # str.split() treats NBSP (\u00a0) as whitespace too.
+    return " ".join(s.split())
+
+
+def split_privileges(s: str) -> Tuple[str, ...]:
+    parts = (p.strip() for p in s.split(","))
+    return tuple(p for p in parts if p)
+
+
+def _cache_path(url: str) -> Path:
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return HTTP_CACHE_DIR / f"{key}.json"
+
+
+def fetch_bytes(url: str, timeout: int = 30, revalidate: bool = True) -> Tuple[bytes, bool, Dict[str, Any]]:
+    """
+    GET url, conditionally on the cached validators when revalidate is set.
+
+    Returns (body, modified, validators). body is the undecoded response
+    bytes, left for lxml to decode while parsing. Page bodies are not cached,
+    so when the server answers 304 modified is False and body is empty.
+    Pass validators to save_validators() once roles/ has been written.
+    """
+    meta_path = _cache_path(url)
+
+    cached: Dict[str, Any] = {}
+    if revalidate and meta_path.exists():
+        cached = json.loads(meta_path.read_text(encoding="utf-8"))
+        if cached.get("script_sha1") != SCRIPT_SHA1:
+            cached = {}
+
+    headers: Dict[str, str] = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    r = SESSION.get(url, timeout=timeout, headers=headers)
+    if r.status_code == 304 and cached:
+        return b"", False, cached
     r.raise_for_status()
-    return r.text
 
+    validators = {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "script_sha1": SCRIPT_SHA1,
+    }
+    return r.content, True, validators
 
-def find_best_table(soup: BeautifulSoup, required_headers: List[str]) -> Optional[Tuple[List[str], BeautifulSoup]]:
+
+def save_validators(validators: Dict[str, Any]) -> None:
+    HTTP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _cache_path(validators["url"]).write_text(json.dumps(validators, indent=2), encoding="utf-8")
+
+
+def find_best_table(
+    root: lxml_html.HtmlElement, required_headers: List[str]
+) -> Optional[Tuple[List[str], lxml_html.HtmlElement]]:
     required = [h.lower() for h in required_headers]
 
-    for table in soup.find_all("table"):
-        header_row = table.find("tr")
-        if not header_row:
+    for table in root.iter("table"):
+        header_row = next(table.iter("tr"), None)
+        if header_row is None:
             continue
-        ths = header_row.find_all("th")
-        if not ths:
+        ths = list(header_row.iter("th"))
+        # Each required header is its own column; narrower tables can't match.
+        if len(ths) < len(required):
             continue
-        headers = [clean(th.get_text()).lower() for th in ths]
-
-        ok = True
-        for req in required:
-            if not any(req in h for h in headers):
-                ok = False
-                break
-        if ok:
+        headers = [clean(th.text_content()).lower() for th in ths]
+
+        # Unit separator keeps a match from straddling two headers.
+        blob = " \x1f".join(headers)
+        if all(req in blob for req in required):
             return headers, table
 
     return None
 
 
-@dataclass(frozen=True)
-class ClassicRow:
+class ClassicRow(NamedTuple):
     endpoint: str
     operation: str
-    required_privileges: str
+    privileges: Tuple[str, ...]
 
 
-@dataclass(frozen=True)
-class ProdRow:
+class ProdRow(NamedTuple):
     endpoint: str
     operation: str
-    privilege_requirements: str
+    privileges: Tuple[str, ...]
     deprecation_date: str  # may be "N/A"
 
 
-def parse_classic(html: str) -> List[ClassicRow]:
-    soup = BeautifulSoup(html, "html.parser")
+def parse_classic(html_bytes: bytes) -> List[ClassicRow]:
+    root = lxml_html.fromstring(html_bytes, parser=HTML_PARSER)
 
     found = find_best_table(
-        soup,
+        root,
         required_headers=["Endpoint", "Operation", "Required Privilege"],
     )
     if not found:
@@ -115,45 +188,37 @@ def parse_classic(html: str) -> List[ClassicRow]:
     if min(i_endpoint, i_operation, i_priv) < 0:
         raise RuntimeError(f"Classic API table headers unexpected: {headers}")
 
-    rows: List[ClassicRow] = []
-    for tr in table.find_all("tr"):
-        tds = tr.find_all("td")
-        if not tds:
-            continue
-        cells = [clean(td.get_text(" ", strip=True)) for td in tds]
+    seen = set()
+    out: List[ClassicRow] = []
+    for tr in _XP_ROWS_WITH_TD(table):
+        cells = [clean(" ".join(td.itertext())) for td in tr.iterchildren("td")]
         if max(i_endpoint, i_operation, i_priv) >= len(cells):
             continue
 
         endpoint = cells[i_endpoint]
         operation = cells[i_operation].upper()
-        privs = cells[i_priv]
+        privs = split_privileges(cells[i_priv])
 
         if not endpoint or not operation:
             continue
 
-        rows.append(
-            ClassicRow(
-                endpoint=endpoint,
-                operation=operation,
-                required_privileges=privs,
-            )
+        row = ClassicRow(
+            endpoint=endpoint,
+            operation=operation,
+            privileges=privs,
         )
-
-    seen = set()
-    out: List[ClassicRow] = []
-    for r in rows:
-        k = (r.endpoint, r.operation, r.required_privileges)
-        if k not in seen:
-            seen.add(k)
-            out.append(r)
+        if row in seen:
+            continue
+        seen.add(row)
+        out.append(row)
     return out
 
 
-def parse_prod(html: str) -> List[ProdRow]:
-    soup = BeautifulSoup(html, "html.parser")
+def parse_prod(html_bytes: bytes) -> List[ProdRow]:
+    root = lxml_html.fromstring(html_bytes, parser=HTML_PARSER)
 
     found = find_best_table(
-        soup,
+        root,
         required_headers=["Endpoint", "Operation", "Privilege Requirements", "Deprecation Date"],
     )
     if not found:
@@ -176,96 +241,80 @@ def parse_prod(html: str) -> List[ProdRow]:
     if min(i_endpoint, i_operation, i_priv, i_depr) < 0:
         raise RuntimeError(f"Prod API table headers unexpected: {headers}")
 
-    rows: List[ProdRow] = []
-    for tr in table.find_all("tr"):
-        tds = tr.find_all("td")
-        if not tds:
-            continue
-        cells = [clean(td.get_text(" ", strip=True)) for td in tds]
+    seen = set()
+    out: List[ProdRow] = []
+    for tr in _XP_ROWS_WITH_TD(table):
+        cells = [clean(" ".join(td.itertext())) for td in tr.iterchildren("td")]
         if max(i_endpoint, i_operation, i_priv, i_depr) >= len(cells):
             continue
 
         endpoint = cells[i_endpoint]
         operation = cells[i_operation].upper()
-        privs = cells[i_priv]
+        privs = split_privileges(cells[i_priv])
         depr = cells[i_depr] if cells[i_depr] else "N/A"
 
         if not endpoint or not operation:
             continue
 
-        rows.append(
-            ProdRow(
-                endpoint=endpoint,
-                operation=operation,
-                privilege_requirements=privs,
-                deprecation_date=depr,
-            )
+        row = ProdRow(
+            endpoint=endpoint,
+            operation=operation,
+            privileges=privs,
+            deprecation_date=depr,
         )
-
-    seen = set()
-    out: List[ProdRow] = []
-    for r in rows:
-        k = (r.endpoint, r.operation, r.privilege_requirements, r.deprecation_date)
-        if k not in seen:
-            seen.add(k)
-            out.append(r)
+        if row in seen:
+            continue
+        seen.add(row)
+        out.append(row)
     return out
 
 
 def build_schema(classic_rows: List[ClassicRow], prod_rows: List[ProdRow]) -> Dict[str, Any]:
-    all_privs = set()
-
-    classic_endpoints = []
-    for r in classic_rows:
-        privs = [p.strip() for p in r.required_privileges.split(",") if p.strip()]
-        classic_endpoints.append(
-            {
-                "endpoint": r.endpoint,
-                "operation": r.operation,
-                "privileges": privs,
-                "deprecation_date": None,
-            }
-        )
-        all_privs.update(privs)
-
-    prod_endpoints = []
-    for r in prod_rows:
-        privs = [p.strip() for p in r.privilege_requirements.split(",") if p.strip()]
-        deprecation = r.deprecation_date.strip() if r.deprecation_date else "N/A"
-        if deprecation.upper() == "N/A":
-            deprecation = None
-        prod_endpoints.append(
-            {
+    all_privs: Set[str] = set()
+    add_privs = all_privs.update
+
+    def endpoints(rows: Sequence[Union[ClassicRow, ProdRow]]) -> Iterator[Dict[str, Any]]:
+        for r in rows:
+            deprecation: Optional[str] = None
+            if isinstance(r, ProdRow):
+                deprecation = r.deprecation_date.strip() if r.deprecation_date else "N/A"
+                if deprecation.upper() == "N/A":
+                    deprecation = None
+            add_privs(r.privileges)
+            yield {
                 "endpoint": r.endpoint,
                 "operation": r.operation,
-                "privileges": privs,
+                "privileges": list(r.privileges),
                 "deprecation_date": deprecation,
             }
-        )
-        all_privs.update(privs)
 
-    categories: Dict[str, List[str]] = {}
-    for privilege in sorted(all_privs):
+    classic_endpoints = list(endpoints(classic_rows))
+    prod_endpoints = list(endpoints(prod_rows))
+
+    now_iso = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    sorted_privs = sorted(all_privs)
+
+    category_sets: Dict[str, Set[str]] = defaultdict(set)
+    for privilege in sorted_privs:
         if " - " in privilege:
             action, resource = privilege.split(" - ", 1)
             action = action.strip()
         else:
             action = "Other"
             resource = privilege
-        categories.setdefault(action, [])
-        if resource not in categories[action]:
-            categories[action].append(resource)
+        category_sets[action].add(resource)
+    categories = {action: sorted(resources) for action, resources in category_sets.items()}
 
     schema: Dict[str, Any] = {
         "version": "1.0.0",
-        "last_updated": datetime.now().isoformat(),
+        "last_updated": now_iso,
         "metadata": {
             "description": "Jamf Pro API Role and Privilege Mappings",
             "source": "Jamf Developer Documentation",
             "documentation_urls": [PROD_URL, CLASSIC_URL],
         },
         "privilege_categories": categories,
-        "all_privileges": sorted(list(all_privs)),
+        "all_privileges": sorted_privs,
         "classic_api": {
             "description": "Classic API (XML-based) endpoints and required privileges",
             "endpoints": classic_endpoints,
@@ -278,59 +327,92 @@ def build_schema(classic_rows: List[ClassicRow], prod_rows: List[ProdRow]) -> Di
     return schema
 
 
+def dump_json(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def write_json(path: Path, obj: Any) -> bool:
+    """
+    Write obj as indented JSON unless path already holds exactly those bytes.
+
+    Returns True when the file was (re)written.
+    """
+    data = dump_json(obj)
+    if path.exists() and path.read_bytes() == data:
+        return False
+    path.write_bytes(data)
+    return True
+
+
 def main() -> int:
     ROLES_DIR.mkdir(parents=True, exist_ok=True)
     DOCS_DIR.mkdir(parents=True, exist_ok=True)
 
     print("🔗 Fetching Jamf docs...")
-    classic_html = fetch_html(CLASSIC_URL)
-    prod_html = fetch_html(PROD_URL)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        classic_future = pool.submit(fetch_bytes, CLASSIC_URL)
+        prod_future = pool.submit(fetch_bytes, PROD_URL)
+        classic_bytes, classic_modified, classic_validators = classic_future.result()
+        prod_bytes, prod_modified, prod_validators = prod_future.result()
+
+    if not (classic_modified or prod_modified) and all((ROLES_DIR / name).exists() for name in OUTPUT_FILES):
+        print("⏭️  Jamf docs not modified since last run; keeping roles/*.json")
+        return 0
+
+    # The other page changed (or roles/ is incomplete); 304s carry no body to parse.
+    if not classic_modified:
+        classic_bytes, _, classic_validators = fetch_bytes(CLASSIC_URL, revalidate=False)
+    if not prod_modified:
+        prod_bytes, _, prod_validators = fetch_bytes(PROD_URL, revalidate=False)
 
     print("📊 Parsing tables...")
-    classic_rows = parse_classic(classic_html)
-    prod_rows = parse_prod(prod_html)
+    classic_rows = parse_classic(classic_bytes)
+    prod_rows = parse_prod(prod_bytes)
 
     print(f"✅ Classic rows: {len(classic_rows)}")
     print(f"✅ Prod rows: {len(prod_rows)}")
 
     schema = build_schema(classic_rows, prod_rows)
 
-    (ROLES_DIR / "jamf-roles.json").write_text(
-        json.dumps(schema, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
-
-    classic_only = {
-        "version": schema["version"],
-        "last_updated": schema["last_updated"],
-        "endpoints": schema["classic_api"]["endpoints"],
-    }
-    (ROLES_DIR / "classic-api-roles.json").write_text(
-        json.dumps(classic_only, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
-
-    prod_only = {
-        "version": schema["version"],
-        "last_updated": schema["last_updated"],
-        "endpoints": schema["jamf_pro_api"]["endpoints"],
+    # If only the timestamp would differ, keep the previous one so unchanged
+    # content stays byte-identical and nothing below gets rewritten.
+    full_path = ROLES_DIR / "jamf-roles.json"
+    if full_path.exists():
+        previous = json.loads(full_path.read_bytes())
+        if "last_updated" in previous and dict(previous, last_updated=schema["last_updated"]) == schema:
+            schema["last_updated"] = previous["last_updated"]
+
+    # The derived files share the endpoint/category objects held by schema.
+    outputs: Dict[str, Any] = {
+        "jamf-roles.json": schema,
+        "classic-api-roles.json": {
+            "version": schema["version"],
+            "last_updated": schema["last_updated"],
+            "endpoints": schema["classic_api"]["endpoints"],
+        },
+        "jamf-pro-api-roles.json": {
+            "version": schema["version"],
+            "last_updated": schema["last_updated"],
+            "endpoints": schema["jamf_pro_api"]["endpoints"],
+        },
+        "privilege-categories.json": {
+            "version": schema["version"],
+            "categories": schema["privilege_categories"],
+            "all_privileges": schema["all_privileges"],
+        },
     }
-    (ROLES_DIR / "jamf-pro-api-roles.json").write_text(
-        json.dumps(prod_only, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
 
-    priv_cats = {
-        "version": schema["version"],
-        "categories": schema["privilege_categories"],
-        "all_privileges": schema["all_privileges"],
-    }
-    (ROLES_DIR / "privilege-categories.json").write_text(
-        json.dumps(priv_cats, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
+    written = [name for name in OUTPUT_FILES if write_json(ROLES_DIR / name, outputs[name])]
+    if written:
+        print(f"🎉 Updated roles/: {', '.join(written)}")
+    else:
+        print("🎉 roles/*.json already up to date")
 
-    print("🎉 Completed writing roles/*.json")
+    # Only now does roles/ reflect these responses, so a failed parse is retried next run.
+    save_validators(classic_validators)
+    save_validators(prod_validators)
     return 0
 
 